@@ -0,0 +1,19 @@
+import datetime
+
+import pytest
+
+pd = pytest.importorskip("pandas")
+re_utils = pytest.importorskip("virgo_modules.src.re_utils")
+
+
+def test_parse_prediction_dates_iso():
+    values = pd.Series(['2023-06-01', '2023-06-02T10:00:00Z', None])
+    result = re_utils.parse_prediction_dates(values)
+    assert result.iloc[:2].tolist() == [datetime.date(2023, 6, 1), datetime.date(2023, 6, 2)]
+    assert pd.isna(result.iloc[2])
+
+
+def test_parse_prediction_dates_mixed_formats():
+    values = pd.Series(['2023-06-01', '06/02/2023 10:00', '2023-06-03T00:00:00Z'])
+    result = re_utils.parse_prediction_dates(values)
+    assert result.tolist() == [datetime.date(2023, 6, 1), datetime.date(2023, 6, 2), datetime.date(2023, 6, 3)]
@@ -1,48 +1,168 @@
 import yaml
 import boto3
+from botocore.config import Config
+from boto3.s3.transfer import TransferConfig
+from functools import lru_cache
+from threading import Lock
 from pathlib import Path
-from io import StringIO, BytesIO
+from io import BytesIO, RawIOBase
 import pandas as pd
 
+S3_CLIENT_CFG = Config(max_pool_connections = 50, retries = {"mode":"adaptive","max_attempts":10}, tcp_keepalive = True, s3 = {'addressing_style':'virtual'})
+try:
+    ## checksums only when the operation requires them, available from botocore 1.36
+    S3_CLIENT_CFG = S3_CLIENT_CFG.merge(Config(request_checksum_calculation = 'when_required', response_checksum_validation = 'when_required'))
+except TypeError:
+    pass
+TRANSFER_CFG = TransferConfig(multipart_threshold = 8*1024*1024, multipart_chunksize = 16*1024*1024, max_concurrency = 10, use_threads = True)
+## boto3.client on the default session is not thread safe, client creation is serialized
+_S3_CLIENT_LOCK = Lock()
 
-def upload_file_to_aws(bucket,key,input_path, aws_credentials):
+@lru_cache(maxsize=None)
+def _get_s3_client(aws_access_key_id, aws_secret_access_key, region_name = None):
     '''
-    upload file from a folder to an s3 folder
+    get a cached s3 client so that the connection pool is reused across calls
+
+            Parameters:
+                    aws_access_key_id (str): aws access key id
+                    aws_secret_access_key (str): aws secret access key
+                    region_name (str): aws region name
+                    
+            Returns:
+                    client (botocore.client.S3): s3 client
+    '''
+    return boto3.client(
+        's3',
+        region_name = region_name,
+        aws_access_key_id = aws_access_key_id,
+        aws_secret_access_key = aws_secret_access_key,
+        config = S3_CLIENT_CFG
+    )
+
+def get_s3_client(aws_credentials):
+    '''
+    get the cached s3 client for an aws credentials dictionary, clients are thread safe once created
+
+            Parameters:
+                    aws_credentials (dict): aws credentials dictionary
+                    
+            Returns:
+                    client (botocore.client.S3): s3 client
+    '''
+    with _S3_CLIENT_LOCK:
+        return _get_s3_client(
+            aws_credentials['AWS_ACCESS_KEY_ID'],
+            aws_credentials['AWS_SECRET_ACCESS_KEY'],
+            aws_credentials.get('AWS_DEFAULT_REGION')
+        )
+
+class _DataFrameCsvStream(RawIOBase):
+    '''
+    read only file-like object that produces the csv bytes of a dataframe on demand, chunk by chunk
+
+            Parameters:
+                    data_frame (pd.DataFrame): data
+                    chunk_size (int): number of rows to format per chunk
+    '''
+    def __init__(self, data_frame, chunk_size = 10000):
+        self._chunks = (
+            data_frame.iloc[i:i+chunk_size].to_csv(header = (i == 0)).encode('utf8')
+            for i in range(0, max(len(data_frame), 1), chunk_size)
+        )
+        self._pending = b''
+        self._offset = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        ## fill b across chunks, read(n) calls readinto once and boto3 sizes the threshold probe and the parts with it
+        written = 0
+        while written < len(b):
+            if self._offset >= len(self._pending):
+                self._pending = next(self._chunks, None)
+                self._offset = 0
+                if self._pending is None:
+                    self._pending = b''
+                    break
+                continue
+            size = min(len(b) - written, len(self._pending) - self._offset)
+            b[written:written+size] = self._pending[self._offset:self._offset+size]
+            self._offset += size
+            written += size
+        return written
+
+def upload_file_to_aws(bucket,key,input_path, aws_credentials, callback = None, extra_args = None):
+    '''
+    upload file from a folder to an s3 folder, large files are sent as concurrent multipart uploads
 
             Parameters:
                     bucket (str): bucket name
                     key (str): key pattern or folder in s3 e.g. path/to/upload/
                     input_path (str): input path of the file to upload e.g. path/to/upload.txt
                     aws_credentials (dict): aws credentials dictionary
+                    callback (function): optional progress callback, receives the number of bytes transferred
+                    extra_args (dict): optional object metadata e.g. {'ContentEncoding':'gzip'}
+                    
+            Returns:
+                    None
+    '''
+    s3 = get_s3_client(aws_credentials)
+    bucket = aws_credentials[bucket]
+    s3.upload_file(Filename=input_path , Bucket=bucket, Key=key, Config=TRANSFER_CFG, Callback=callback, ExtraArgs=extra_args)
+
+def upload_bytes_to_aws(data, bucket, key, aws_credentials, extra_args = None, s3 = None):
+    '''
+    upload in memory bytes to an s3 folder
+
+            Parameters:
+                    data (bytes): content to upload
+                    bucket (str): bucket name
+                    key (str): key pattern or folder in s3 e.g. path/to/upload/file.json
+                    aws_credentials (dict): aws credentials dictionary
+                    extra_args (dict): optional object metadata e.g. {'ContentEncoding':'gzip'}
+                    s3 (botocore.client.S3): optional s3 client, resolved from aws_credentials if not given
                     
             Returns:
                     None
     '''
-    session = boto3.Session(aws_access_key_id=aws_credentials['AWS_ACCESS_KEY_ID'],aws_secret_access_key=aws_credentials['AWS_SECRET_ACCESS_KEY'])
+    if s3 is None:
+        s3 = get_s3_client(aws_credentials)
     bucket = aws_credentials[bucket]
-    s3 = session.resource('s3')
-    s3.meta.client.upload_file(Filename=input_path , Bucket=bucket, Key=key)
+    s3.upload_fileobj(BytesIO(data), bucket, key, Config=TRANSFER_CFG, ExtraArgs=extra_args)
 
-def upload_pandas_to_s3(data_frame,bucket,key, aws_credentials):
+def upload_pandas_to_s3(data_frame,bucket,key, aws_credentials, fmt = 'csv'):
     '''
-    upload dataframe as csv to an s3 folder
+    upload dataframe as csv or parquet to an s3 folder
 
             Parameters:
                     data_frame (pd.DataFrame): data
                     bucket (str): bucket name
                     key (str): key pattern or folder in s3 e.g. path/to/upload/
                     aws_credentials (dict): aws credentials dictionary
+                    fmt (str): file format, csv or parquet. parquet requires pyarrow and a .csv key suffix is switched to .parquet
                     
             Returns:
                     None
     '''
-    csv_buffer = StringIO()
-    data_frame.to_csv(csv_buffer)
-    csv_buffer.seek(0)
+    if fmt == 'parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        buffer = BytesIO()
+        table = pa.Table.from_pandas(data_frame)
+        pq.write_table(table, buffer, compression='zstd')
+        buffer.seek(0)
+        if key.endswith('.csv'):
+            key = key[:-len('.csv')] + '.parquet'
+    elif fmt == 'csv':
+        ## csv is formatted lazily while it is uploaded, so the full file is never held in memory
+        buffer = _DataFrameCsvStream(data_frame)
+    else:
+        raise Exception(f"fmt has to be csv or parquet, got {fmt}")
 
-    s3 = boto3.client("s3",region_name=aws_credentials['AWS_DEFAULT_REGION'],aws_access_key_id=aws_credentials['AWS_ACCESS_KEY_ID'],aws_secret_access_key=aws_credentials['AWS_SECRET_ACCESS_KEY'])
+    s3 = get_s3_client(aws_credentials)
     bucket = aws_credentials[bucket]
-    s3.put_object(Bucket=bucket, Body=csv_buffer.getvalue(), Key= key)
+    s3.upload_fileobj(buffer, bucket, key, Config=TRANSFER_CFG)
 
 def download_file_to_aws(bucket,key, aws_credentials):
     '''
@@ -56,12 +176,7 @@ def download_file_to_aws(bucket,key, aws_credentials):
             Returns:
                     None
     '''
-    s3c = boto3.client(
-            's3', 
-            region_name = aws_credentials['AWS_DEFAULT_REGION'],
-            aws_access_key_id = aws_credentials['AWS_ACCESS_KEY_ID'],
-            aws_secret_access_key = aws_credentials['AWS_SECRET_ACCESS_KEY']
-        )
+    s3c = get_s3_client(aws_credentials)
     obj = s3c.get_object(Bucket= bucket , Key = key)
     df = pd.read_csv(BytesIO(obj['Body'].read()), encoding='utf8')
-    return df
\ No newline at end of file
+    return df
@@ -1,3 +1,4 @@
+import pandas as pd
 import numpy as np
 import itertools
 
@@ -9,7 +10,7 @@ from feature_engine.imputation import  MeanMedianImputer
 from feature_engine.discretisation import EqualWidthDiscretiser
 from feature_engine.datetime import DatetimeFeatures
 
-from ..transformer_utils import VirgoWinsorizerFeature, InverseHyperbolicSine, FeaturesEntropy, FeatureSelector
+from ..transformer_utils import VirgoWinsorizerFeature, InverseHyperbolicSine, ParallelFeaturesEntropy, FeatureSelector
 
 from plotly.subplots import make_subplots
 import plotly.graph_objects as go
@@ -21,7 +22,7 @@ class produce_model_wrapper:
     Attributes
     ----------
     data : pd.DataFrame
-        list of features to apply the transformation
+        input data, kept as a reference (not copied) and only read
     X_train : pd.DataFrame
     y_train : pd.DataFrame
     X_val : pd.DataFrame
@@ -42,13 +43,13 @@ class produce_model_wrapper:
 
         Parameters
         ----------
-        data (pd.DataFrame): data
+        data (pd.DataFrame): data, it is not copied so it should not be modified while the object is in use
 
         Returns
         -------
         None
         """
-        self.data = data.copy()
+        self.data = data
     
     def preprocess(self, validation_size, target):
         """
@@ -63,18 +64,18 @@ class produce_model_wrapper:
         -------
         None
         """
-        val_date = self.data.groupby('Date', as_index = False).agg(target_down = (target[0],'count')).sort_values('Date').iloc[-validation_size:,].head(1)['Date'].values[0]
-        
-        train_data = self.data[self.data['Date'] < val_date].dropna()
-        val_data = self.data[self.data['Date'] >= val_date].dropna()
-
-        columns = [ x for x in train_data.columns if x not in target ]
-        X_train, y_train = train_data[columns], train_data[target]
-        X_val, y_val = val_data[columns], val_data[target]
-        self.X_train = X_train
-        self.y_train = y_train
-        self.X_val = X_val
-        self.y_val = y_val
+        dates = np.sort(self.data['Date'].dropna().unique())
+        val_date = dates[-validation_size:][0]
+        is_train = (self.data['Date'] < val_date).to_numpy()
+        is_complete = self.data.notna().all(axis = 1).to_numpy()
+        train_mask = is_complete & is_train
+        val_mask = is_complete & ~is_train
+
+        columns = [ x for x in self.data.columns if x not in target ]
+        self.X_train = self.data.loc[train_mask, columns]
+        self.y_train = self.data.loc[train_mask, target]
+        self.X_val = self.data.loc[val_mask, columns]
+        self.y_val = self.data.loc[val_mask, target]
     
     def train_model(self, pipe, model, cv_ = False):
         """
@@ -93,7 +94,45 @@ class produce_model_wrapper:
         self.pipe_transform = pipe
         self.pipeline = Pipeline([('pipe_transform',self.pipe_transform), ('model',self.model)])
         self.pipeline.fit(self.X_train, self.y_train)
-        self.features_to_model = self.pipeline[:-1].transform(self.X_train).columns
+        ## output feature names from the fitted steps, custom transformers without names are resolved with a one row transform
+        try:
+            self.features_to_model = pd.Index(self.pipeline[:-1].get_feature_names_out())
+        except (AttributeError, NotImplementedError, TypeError, ValueError):
+            self.features_to_model = self.pipeline[:-1].transform(self.X_train.iloc[:1].copy()).columns
+
+def get_pipeline_predictions(pipeline, X):
+    '''
+    get probabilities and predictions from a model pipeline, the transformation steps and the model are run only once.
+    predictions are taken as the class with the highest probability
+
+            Parameters:
+                    pipeline (obj): model pipeline or model
+                    X (pd.DataFrame): input data
+
+            Returns:
+                    preds_proba (np.array): predicted probabilities, one column per target for multi output models
+                    preds (np.array): predictions
+    '''
+    if isinstance(pipeline, Pipeline):
+        model = pipeline._final_estimator
+        X_transformed = pipeline[:-1].transform(X) if len(pipeline) > 1 else X
+    else:
+        model = pipeline
+        X_transformed = X
+
+    preds_proba = model.predict_proba(X_transformed)
+
+    ## labels are the most probable class, as in sklearn classifiers predict
+    if type(preds_proba) == list:
+        ## multi output models: stack into (samples, classes, targets), targets share the same number of classes
+        probas = np.stack(preds_proba, axis = -1)
+        classes = np.column_stack(model.classes_)
+        preds = np.take_along_axis(classes, np.argmax(probas, axis = 1), axis = 0)
+        preds_proba = probas[:,1,:]
+    else:
+        preds = model.classes_[np.argmax(preds_proba, axis = 1)]
+
+    return preds_proba, preds
 
 class register_results():
     """
@@ -143,11 +182,7 @@ class register_results():
         -------
         None
         """
-        preds_proba = pipeline.predict_proba(X)
-        preds = pipeline.predict(X)
-    
-        if type(preds_proba) == list:
-            preds_proba = np.array([ x[:,1]  for x in preds_proba]).T
+        preds_proba, preds = get_pipeline_predictions(pipeline, X)
 
         roc = roc_auc_score(y,preds_proba, average=None)
         precision = precision_score(y,preds, average=None)
@@ -167,21 +202,14 @@ class register_results():
         -------
         None
         """
-        parts = list(self.metric_logger.keys())
-        phase_parts = [ x.split('//')[0] for x in parts]
-    
-        parts = list(self.metric_logger)
-        phase_parts = [ x.split('//')[0] for x in parts]
-        
-        init_phase = phase_parts[0]
-        print(f'---{init_phase}--')
-        for phase,val in zip(phase_parts,self.metric_logger):
-            stage = val.split('//')[2]
-            if init_phase != phase:
-                print(f'---{phase}--')
-                init_phase = phase
-            for metric in self.metric_logger[val]:
-                print(stage, metric,self.metric_logger[val][metric])
+        parts = [ (key.split('//'), key) for key in self.metric_logger]
+
+        for phase, group in itertools.groupby(parts, key = lambda x: x[0][0]):
+            print(f'---{phase}--')
+            for key_parts, key in group:
+                stage = key_parts[2]
+                for metric, value in self.metric_logger[key].items():
+                    print(stage, metric, value)
 
 
 def eval_metrics(pipeline, X, y, type_data, model_name):
@@ -198,12 +226,8 @@ def eval_metrics(pipeline, X, y, type_data, model_name):
             Returns:
                     objects (dict): that contains ml artifacts, data , configs and models
     '''
-    preds_proba = pipeline.predict_proba(X)
-    preds = pipeline.predict(X)
+    preds_proba, preds = get_pipeline_predictions(pipeline, X)
 
-    if type(preds_proba) == list:
-        preds_proba = np.array([ x[:,1]  for x in preds_proba]).T
-            
     print(f'--{type_data} - {model_name}--')
     print('--target: down, up--')
     print('--roc-auc--')
@@ -250,13 +274,7 @@ def data_processing_pipeline_classifier(
     invhypersin_pipe = [('invhypervolsin scaler', InverseHyperbolicSine(features = invhypervolsin_features))] if invhypervolsin_features else []
     datetimeFeatures_pipe = [('date features', DatetimeFeatures(features_to_extract = date_features_list, variables = 'Date', drop_original = False))] if date_features_list else []
     
-    entropy_pipe = list()
-    if entropy_set_list:
-        for setx_ in entropy_set_list:
-            setx = setx_['set'].split('//')
-            target_ = setx_['target']
-            subpipe_name = '_'.join(setx) + 'entropy'
-            entropy_pipe.append((subpipe_name, FeaturesEntropy(features = setx, target = target_)))
+    entropy_pipe = [('entropy_features', ParallelFeaturesEntropy(entropy_set_list))] if entropy_set_list else []
     
     pipe_dictionary = {
         'selector': select_pipe,
@@ -272,12 +290,14 @@ def data_processing_pipeline_classifier(
 
     pipeline_steps = pipeline_order.split('//')
     ## validation
+    invalid_steps = set(pipeline_steps).difference(pipe_dictionary)
     for step in pipeline_steps:
-        if step not in pipe_dictionary.keys():
+        if step in invalid_steps:
             raise Exception(f'{step} step not in list of steps, the list is: {list(pipe_dictionary.keys())}')
-        
-    pipeline_args = [ pipe_dictionary[step] for step in pipeline_steps]
-    pipeline_args = list(itertools.chain.from_iterable(pipeline_args))
+
+    pipeline_args = list()
+    for step in pipeline_steps:
+        pipeline_args.extend(pipe_dictionary[step])
     pipe = Pipeline(pipeline_args)
 
     return pipe
@@ -312,7 +332,7 @@ class ExpandingMultipleTimeSeriesKFold:
 
         Parameters
         ----------
-        df (pd.DataFrame): dataset
+        df (pd.DataFrame): dataset, it requires Date_i and i in the index
         number_window (int): number of train splits
         window_size (int): window size data
         overlap_size (int): overlap size
@@ -321,10 +341,18 @@ class ExpandingMultipleTimeSeriesKFold:
         -------
         None
         """
+        if 'Date_i' not in df.index.names or 'i' not in df.index.names:
+            raise Exception('no date and/or index in the index dataframe')
+
         self.df = df
         self.number_window = number_window
         self.window_size = window_size
         self.overlap_size = overlap_size
+
+        date_level = df.index.get_level_values('Date_i').to_numpy()
+        self._i_level = df.index.get_level_values('i').to_numpy()
+        self._date_order = np.argsort(date_level, kind = 'stable')
+        self._sorted_dates = date_level[self._date_order]
         
     def split(self, X, y, groups=None):
         """
@@ -340,14 +368,11 @@ class ExpandingMultipleTimeSeriesKFold:
         -------
         None
         """
-        if 'Date_i' not in self.df.index.names or 'i' not in self.df.index.names:
-            raise Exception('no date and/or index in the index dataframe')
-        
         if self.overlap_size > self.window_size:
             raise Exception('overlap can not be higher than the window size')
 
-        unique_dates = list(self.df.index.get_level_values('Date_i').unique())
-        unique_dates.sort()
+        sorted_dates, date_order, i_level = self._sorted_dates, self._date_order, self._i_level
+        unique_dates = np.unique(sorted_dates)
     
         total_test_size = self.window_size * self.number_window
         total_test_size = total_test_size - (self.number_window - 1)*self.overlap_size
@@ -359,19 +384,19 @@ class ExpandingMultipleTimeSeriesKFold:
         for fold in range(self.number_window):
             
             topcut = cut-self.window_size
-            train_dates = unique_dates[:-cut]
-            test_dates = unique_dates[-cut:-topcut]
-            
-            if topcut == 0:
-                test_dates = unique_dates[-cut:]
-        
-            max_train_date = max(train_dates)
-            min_test_date, max_test_date = min(test_dates), max(test_dates)
+            ## unique dates are sorted, so the window limits are direct positions
+            max_train_date = unique_dates[-cut-1]
+            min_test_date = unique_dates[-cut]
+            max_test_date = unique_dates[-topcut-1] if topcut != 0 else unique_dates[-1]
             
             cut = cut - (self.window_size - self.overlap_size) 
         
-            train_index = self.df[self.df.index.get_level_values('Date_i') <= max_train_date].index.get_level_values('i')
-            test_index = self.df[(self.df.index.get_level_values('Date_i') >= min_test_date) & (self.df.index.get_level_values('Date_i') <= max_test_date)].index.get_level_values('i')
+            ## binary search on the sorted dates, positions are sorted back to keep the original row order
+            train_end = np.searchsorted(sorted_dates, max_train_date, side = 'right')
+            test_start = np.searchsorted(sorted_dates, min_test_date, side = 'left')
+            test_end = np.searchsorted(sorted_dates, max_test_date, side = 'right')
+            train_index = i_level[np.sort(date_order[:train_end])]
+            test_index = i_level[np.sort(date_order[test_start:test_end])]
         
             yield train_index, test_index
 
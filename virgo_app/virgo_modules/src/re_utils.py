@@ -3,6 +3,8 @@ import matplotlib.gridspec as gridspec
 import seaborn as sns; sns.set()
 import matplotlib.patheffects as path_effects
 from  matplotlib.dates import DateFormatter
+from matplotlib.cbook import boxplot_stats
+from matplotlib.lines import Line2D
 
 import plotly.express as px
 from plotly.subplots import make_subplots
@@ -13,6 +15,10 @@ import pandas as pd
 import numpy as np
 import math
 import json
+import gzip
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, cached_property
 
 import datetime
 from dateutil.relativedelta import relativedelta
@@ -27,16 +33,22 @@ from pathlib import Path
 
 import mlflow
 
-from pykalman import KalmanFilter
-from .aws_utils import upload_file_to_aws
+from .aws_utils import upload_file_to_aws, upload_bytes_to_aws, get_s3_client
+
+try:
+    ## plotly encodes numpy arrays natively and much faster through orjson when it is installed
+    import orjson
+    PLOTLY_JSON_ENGINE = 'orjson'
+except ImportError:
+    PLOTLY_JSON_ENGINE = 'json'
 
 def calculate_cointegration(series_1, series_2):
     '''
     calculate cointegration score of two time series.
 
             Parameters:
-                    series_1 (pd.series): pandas series of the asset returns
-                    series_2 (pd.series): pandas series of the asset returns
+                    series_1 (pd.series or np.array): asset returns
+                    series_2 (pd.series or np.array): asset returns
 
             Returns:
                     coint_flag (int): cointegration flag, 1 or 0. 1 if p value and coint_t lower than 0.05 and critical value
@@ -44,6 +56,7 @@ def calculate_cointegration(series_1, series_2):
     '''
 
     coint_flag = 0
+    series_1, series_2 = np.asarray(series_1), np.asarray(series_2)
     coint_res = coint(series_1, series_2)
     coint_t = coint_res[0]
     p_value = coint_res[1]
@@ -93,11 +106,11 @@ class pair_finder():
         -------
         None
         """
-        df = raw_data[[asset_1, asset_2]]
-        coint_flag, hedge_ratio = calculate_cointegration(df[asset_1], df[asset_2])
-        spread = df[asset_1] - (hedge_ratio * df[asset_2])
-        df['spread'] = spread
-        self.df = df
+        asset_1_values = raw_data[asset_1].to_numpy()
+        asset_2_values = raw_data[asset_2].to_numpy()
+        coint_flag, hedge_ratio = calculate_cointegration(asset_1_values, asset_2_values)
+        spread = asset_1_values - (hedge_ratio * asset_2_values)
+        self.df = pd.DataFrame({asset_1: asset_1_values, asset_2: asset_2_values, 'spread': spread}, index = raw_data.index)
         self.asset_1 = asset_1
         self.asset_2 = asset_2
         
@@ -117,21 +130,19 @@ class pair_finder():
         """
         self.z_threshold = z_threshold
         spread_series = pd.Series(self.df.spread)
-        mean = spread_series.rolling(center = False, window = window).mean()
-        std = spread_series.rolling(center = False, window = window).std()
-        x = spread_series.rolling(center=False, window =  1).mean()
-        z_score = (x - mean)/std
+        spread_rolling = spread_series.rolling(center = False, window = window)
+        mean = spread_rolling.mean()
+        std = spread_rolling.std()
+        z_score = (spread_series - mean)/std
 
         self.df['z_score'] = z_score
 
-        pvalue = round(adfuller(z_score.dropna().values)[1],4)
         if verbose:
+            pvalue = round(adfuller(z_score.dropna().values)[1],4)
             print(f'p value of the rolling z-score is {pvalue}')
-        up_signal = np.where(z_score >= z_threshold,1,0)
-        low_signal = np.where(z_score <= -z_threshold,1,0)
-
-        self.df['up_pair_signal'] = up_signal
-        self.df['low_pair_signal'] = low_signal
+        z_values = z_score.to_numpy()
+        self.df['up_pair_signal'] = (z_values >= z_threshold).astype(np.int8)
+        self.df['low_pair_signal'] = (z_values <= -z_threshold).astype(np.int8)
         
     def plot_scores(self):
         """
@@ -199,56 +210,40 @@ class pair_finder():
             df[feature_] = (df[self.asset_1].shift(-days)/df[self.asset_1]-1)*100
             returns_list.append(feature_)
 
-        df['signal_type'] = np.where(
-            df['up_pair_signal'] == 1, 
-            'up', 
-            np.where(
-                df['low_pair_signal'] == 1, 
-                'down',
-                None
-            )
-        )
-        df = df[~df.signal_type.isna()]
-        df['Date_'] = df.index
-        df['lag_Date'] = df['Date_'].shift(1)
-        df['span'] = (pd.to_datetime(df['Date_']) - pd.to_datetime(df['lag_Date'])).dt.days - 1
-        df['break'] = np.where(df['span'] > 3, 1, 0)
-        df['break'] = np.where(df['span'].isna(), 1, df['break'])
-        
-        df['chain_id'] = df.sort_values(['Date_']).groupby(['break']).cumcount() + 1
-        df['chain_id'] = np.where(df['break'] == 1, df['chain_id'], np.nan )
-        df['chain_id'] = df['chain_id'].fillna(method = 'ffill')
+        ## up signal has priority, rows without signal are discarded
+        is_up = (df['up_pair_signal'] == 1).to_numpy()
+        is_signal = is_up | (df['low_pair_signal'] == 1).to_numpy()
+        df = df[is_signal]
+        df['signal_type'] = pd.Categorical.from_codes(is_up[is_signal].astype(np.int8), categories = ['down','up'])
+        ## rows are in date order, chains are numbered and ranked with prefix operations
+        signal_dates = df.index.values.astype('datetime64[ns]')
+        span = np.diff(signal_dates) // np.timedelta64(1, 'D') - 1
+        break_flag = np.append(True, span > 3)[:len(df)]
+        positions = np.arange(len(df))
+        chain_start = np.maximum.accumulate(np.where(break_flag, positions, 0))
 
-        df['internal_rn'] = df.sort_values(['Date_']).groupby(['chain_id']).cumcount() + 1
-        df['inv_internal_rn'] = df.sort_values(['Date_'],ascending = False).groupby(['chain_id']).cumcount() + 1
+        df['chain_id'] = np.cumsum(break_flag)
+        df['internal_rn'] = positions - chain_start + 1
 
-        df['first_in_chain'] = np.where(df['internal_rn'] == 1, True, False)
-        df['last_in_chain'] = np.where(df['inv_internal_rn'] == 1, True, False)
+        df['first_in_chain'] = break_flag
+        df['last_in_chain'] = np.append(break_flag[1:], True)[:len(df)]
 
-        df = df.drop(columns = ['break','span','Date_','lag_Date','inv_internal_rn']).sort_index()
         self.df_signal = df
         
         n_signals_up = len(list(df[df.signal_type == 'up'].chain_id.unique()))
         n_signals_down = len(list(df[df.signal_type == 'down'].chain_id.unique()))
-        p_scores = list()
-        medians_down = list()
-        validations = list()
         if not signal_position: ### for now it is based on the last signal on a chain
-            df_melt = df[df.last_in_chain == True].melt(id_vars=['signal_type'], value_vars=returns_list, var_name='time', value_name='value')
-            df_melt = df_melt.dropna()
-            
-        for evalx in returns_list:
-
-            sample1 = df_melt[(df_melt.time == evalx) & (df_melt.signal_type == 'up')].value.values
-            sample2 = df_melt[(df_melt.time == evalx) & (df_melt.signal_type == 'down')].value.values
-            pvalue = stats.ttest_ind(sample1, sample2).pvalue
-            median_down = np.median(sample2)
-            median_up = np.median(sample1) 
-            validations.append(median_up < 0)
-            validations.append(median_down > 0)
-            p_scores.append(pvalue)
-            medians_down.append(median_down)
-        self.df_melt = df_melt
+            last_signals = df[df.last_in_chain == True]
+            is_up = (last_signals.signal_type == 'up').to_numpy()
+            is_down = (last_signals.signal_type == 'down').to_numpy()
+            returns_values = last_signals[returns_list].to_numpy(dtype = float)
+
+        ## one test per return horizon (column), nulls are omitted per column
+        up_values, down_values = returns_values[is_up], returns_values[is_down]
+        p_scores = np.asarray(stats.ttest_ind(up_values, down_values, axis = 0, nan_policy = 'omit').pvalue, dtype = float)
+        medians_up = np.nanmedian(up_values, axis = 0)
+        medians_down = np.nanmedian(down_values, axis = 0)
+        validations = np.column_stack([medians_up < 0, medians_down > 0]).ravel().tolist()
         null_ho_eval = threshold > np.mean(p_scores)
         mean_median_return = np.median(medians_down)  ## end metric
         median_signal_type_eval = validations.count(validations[0]) == len(validations)
@@ -283,6 +278,9 @@ class pair_finder():
             sns.boxplot(data=df[df.last_in_chain == True], y="internal_rn",ax = axs[1])
             axs[1].set_title('signal duration distribution')
             
+            df_melt = last_signals.melt(id_vars=['signal_type'], value_vars=returns_list, var_name='time', value_name='value')
+            df_melt = df_melt.dropna()
+            self.df_melt = df_melt
             sns.boxplot(data=df_melt, x="time", y="value", hue="signal_type",ax = axs[2])
             axs[2].axhline(y=0, color='grey', linestyle='--')
             axs[2].set_title('signal type expected returns distribution at different time lapses')
@@ -304,54 +302,35 @@ class pair_finder():
         None
         """
         asset_1 = self.asset_1
-        df1 = self.df.iloc[-test_size:,:].copy()
-        df2 = df1.copy()
-        df2['signal_type'] = np.where(
-                    df2['up_pair_signal'] == 1, 
-                    'up', 
-                    np.where(
-                        df2['low_pair_signal'] == 1, 
-                        'down',
-                        None
-                    )
-                )
-        df2 = df2[~df2.signal_type.isna()]
-        df2['Date_'] = df2.index
-        df2['lag_Date'] = df2['Date_'].shift(1)
-        df2['span'] = (pd.to_datetime(df2['Date_']) - pd.to_datetime(df2['lag_Date'])).dt.days - 1
-        df2['break'] = np.where(df2['span'] > 3, 1, 0)
-        df2['break'] = np.where(df2['span'].isna(), 1, df2['break'])
-
-        df2['chain_id'] = df2.sort_values(['Date_']).groupby(['break']).cumcount() + 1
-        df2['chain_id'] = np.where(df2['break'] == 1, df2['chain_id'], np.nan )
-        df2['chain_id'] = df2['chain_id'].fillna(method = 'ffill')
-
-        df2['internal_rn'] = df2.sort_values(['Date_']).groupby(['chain_id']).cumcount() + 1
-        df2['inv_internal_rn'] = df2.sort_values(['Date_'],ascending = False).groupby(['chain_id']).cumcount() + 1
-
-        df2['first_in_chain'] = np.where(df2['internal_rn'] == 1, True, False)
-        df2['last_in_chain'] = np.where(df2['inv_internal_rn'] == 1, True, False)
-
-        df2 = df2.drop(columns = ['break','span','Date_','lag_Date','inv_internal_rn']).sort_index()
-
-        df2 = df2[(df2.last_in_chain == True) & (df2.signal_type == 'down')][['last_in_chain']]
-        dft = df1.merge(df2,how = 'left',left_index=True, right_index=True )
-
-        dft['chain_id'] = dft.sort_values(['Date']).groupby(['last_in_chain']).cumcount() + 1
-        dft['chain_id'] = np.where(dft['last_in_chain'] == True, dft['chain_id'], np.nan )
-        dft['chain_id'] = dft['chain_id'].fillna(method = 'ffill')
-
-        dft['internal_rn'] = dft.sort_values(['Date']).groupby(['chain_id']).cumcount() + 1
-        dft['flag'] = np.where(dft['internal_rn'] < days_strategy, 1,0)
-
-        dft['lrets_bench'] = np.log(dft[asset_1]/dft[asset_1].shift(1))
+        ## sorted once by date, the rest of the method relies on this order
+        dft = self.df.iloc[-test_size:,:].sort_index()
+        ## only the last signal of each down chain is needed
+        is_up = (dft['up_pair_signal'] == 1).to_numpy()
+        is_signal = is_up | (dft['low_pair_signal'] == 1).to_numpy()
+        signal_dates = dft.index.values[is_signal].astype('datetime64[ns]')
+        span = np.diff(signal_dates) // np.timedelta64(1, 'D') - 1
+        break_flag = np.append(True, span > 3)[:len(signal_dates)]
+        last_in_chain = np.append(break_flag[1:], True)[:len(signal_dates)]
+        is_last_down = last_in_chain & ~is_up[is_signal]
+
+        ## each down chain end opens a position, rows before the first one are not in any position
+        is_chain_start = np.zeros(len(dft), dtype = bool)
+        is_chain_start[np.flatnonzero(is_signal)[is_last_down]] = True
+        positions = np.arange(len(dft))
+        chain_start = np.maximum.accumulate(np.where(is_chain_start, positions, -1))
+        internal_rn = positions - chain_start + 1
+        dft['flag'] = np.where((chain_start >= 0) & (internal_rn < days_strategy), 1, 0)
+
+        log_prices = np.log(dft[asset_1].to_numpy(dtype = float))
+        log_returns = np.diff(log_prices)
+        dft['lrets_bench'] = np.append(np.nan, log_returns)[:len(dft)]
         dft['bench_prod'] = dft['lrets_bench'].cumsum()
-        dft['bench_prod_exp'] = np.exp(dft['bench_prod']) - 1
+        dft['bench_prod_exp'] = np.expm1(dft['bench_prod'])
 
-        dft['lrets_strat'] = np.log(dft[asset_1].shift(-1)/dft[asset_1]) * dft['flag']
+        dft['lrets_strat'] = np.append(log_returns, np.nan)[:len(dft)] * dft['flag']
         dft['lrets_strat'] = np.where(dft['lrets_strat'].isna(),-0.0,dft['lrets_strat'])
         dft['lrets_prod'] = dft['lrets_strat'].cumsum()
-        dft['strat_prod_exp'] = np.exp(dft['lrets_prod']) - 1
+        dft['strat_prod_exp'] = np.expm1(dft['lrets_prod'])
 
         bench_rets = round(dft['bench_prod_exp'].values[-1]*100,1)
         strat_rets = round(dft['strat_prod_exp'].values[-1]*100,1)
@@ -367,7 +346,7 @@ class pair_finder():
         plt.title('strategy and cumulative returns based on signal strategy')
         plt.plot()
 
-        del df1,df2,dft
+        del dft
         
 def produce_big_dataset(data_frames, stocks_codes_, feature_list, limit = 500):
     '''
@@ -394,18 +373,15 @@ def produce_big_dataset(data_frames, stocks_codes_, feature_list, limit = 500):
         
     features_list = ['Date','Close'] + feature_list_
     
-    list_df = list()
-    for ticket in stocks_codes_:
-        
-        df = data_frames[ticket]
-        for j in features_list:
-            if j not in df.columns:
-                df[j] = df.get(j, np.nan)   
-        
-        df = df[features_list].sort_values('Date').iloc[-limit:,:]
+    def shape_ticket_data(ticket):
+        ## missing features are added as null columns in a single reindex
+        df = data_frames[ticket].reindex(columns = features_list).sort_values('Date').iloc[-limit:,:]
         df['Ticket'] = ticket
-        list_df.append(df)
-    dataframe = pd.concat(list_df)
+        return df
+
+    with ThreadPoolExecutor(max_workers = os.cpu_count()) as executor:
+        list_df = list(executor.map(shape_ticket_data, stocks_codes_))
+    dataframe = pd.concat(list_df, copy = False)
     return dataframe
 
 def ranking(data, weighted_features, top = 5, window = 5):
@@ -425,33 +401,26 @@ def ranking(data, weighted_features, top = 5, window = 5):
     features = weighted_features.keys()
     up_columns = ['signal_up_' + x for x in features]
     low_columns = ['signal_low_' + x for x in features]
-    
+    signal_columns = low_columns + up_columns
+    weights = np.array([weighted_features.get(x) for x in features]*2, dtype = float)
+
     ticket_list= list(data.Ticket.unique())
-    result = dict()
-    for ticket in ticket_list:
-        result[ticket] = dict()
-        df = data[data.Ticket == ticket].sort_values('Date').iloc[-window:]
-        max_date = max(df['Date'])
-        
-        for col in low_columns:
-            weight = weighted_features.get(col.replace('signal_low_',''))
-            new_col = f'weighted_{col}'
-            df[new_col] =  df[col]/((max_date - df['Date']) / np.timedelta64(1, 'D')+1) * weight
-            sum_signal = np.sum(df[new_col].values)
-            result[ticket][col] = sum_signal
-        for col in up_columns:
-            weight = weighted_features.get(col.replace('signal_up_',''))
-            new_col = f'weighted_{col}'
-            df[new_col] =  df[col]/((max_date - df['Date']) / np.timedelta64(1, 'D')+1) * weight
-            sum_signal = np.sum(df[new_col].values)
-            result[ticket][col] = sum_signal
-            
-    df = pd.DataFrame(result).T
+    df = data.sort_values('Date').groupby('Ticket', sort = False).tail(window)
+    days_back = (df.groupby('Ticket', sort = False)['Date'].transform('max') - df['Date']) / np.timedelta64(1, 'D') + 1
+    weighted_signals = pd.DataFrame(
+        df[signal_columns].to_numpy(dtype = float) / days_back.to_numpy()[:,None] * weights,
+        columns = signal_columns,
+        index = df['Ticket'].to_numpy()
+    )
+    ## a null signal in the window makes the ticket sum null
+    null_signals = weighted_signals.isna().groupby(level = 0, sort = False).any()
+    df = weighted_signals.groupby(level = 0, sort = False).sum().mask(null_signals).reindex(ticket_list)
+
     df['up_signas'] = df[up_columns].sum(axis=1)
     df['low_signas'] = df[low_columns].sum(axis=1)
     
-    top_up = list(df.sort_values('up_signas', ascending = False).index)[:top]
-    top_low = list(df.sort_values('low_signas', ascending = False).index)[:top]
+    top_up = list(df.nlargest(top, 'up_signas').index)
+    top_low = list(df.nlargest(top, 'low_signas').index)
     
     return top_up, top_low, df
 
@@ -544,7 +513,7 @@ def produce_dashboard(data, columns , ticket_list, show_plot = True, nrows = 150
         show_legend = True if i == 1 else False
         df = data[data.Ticket == ticket].sort_values('Date').iloc[-nrows:,:]
         
-        fig.add_trace(go.Scatter(x=df['Date'], y=df['Close'],legendgroup="Close",showlegend = show_legend , mode='lines',name = 'Close', marker_color = 'blue'),col = 1, row = i)
+        fig.add_trace(go.Scattergl(x=df['Date'], y=df['Close'],legendgroup="Close",showlegend = show_legend , mode='lines',name = 'Close', marker_color = 'blue'),col = 1, row = i)
 
         ### signals
         
@@ -553,13 +522,15 @@ def produce_dashboard(data, columns , ticket_list, show_plot = True, nrows = 150
             norm_list = [f'norm_{feature}', f'z_{feature}', feature]
             for norm_feat in norm_list:
                 if norm_feat in df.columns:
-                    fig.add_trace(go.Scatter(x=df['Date'], y=df[norm_feat],legendgroup="Close",showlegend = False , mode='lines',name = 'Close', marker_color = 'blue'),col = j, row = i)
+                    fig.add_trace(go.Scattergl(x=df['Date'], y=df[norm_feat],legendgroup="Close",showlegend = False , mode='lines',name = 'Close', marker_color = 'blue'),col = j, row = i)
                     break
             signal_up = f'signal_up_{feature}'
             signal_low = f'signal_low_{feature}'
             try:
-                fig.add_trace(go.Scatter(x=df['Date'], y=np.where(df[signal_up] == 1, df[norm_feat], np.nan),showlegend = False, mode='markers',name = 'high up', marker_color = 'green'),col = j, row = i)
-                fig.add_trace(go.Scatter(x=df['Date'], y=np.where(df[signal_low] == 1, df[norm_feat], np.nan),showlegend = False, mode='markers',name = 'high low', marker_color = 'red'),col = j, row = i)
+                ## only the signal points are sent to the trace
+                is_up, is_low = df[signal_up] == 1, df[signal_low] == 1
+                fig.add_trace(go.Scattergl(x=df['Date'][is_up], y=df[norm_feat][is_up],showlegend = False, mode='markers',name = 'high up', marker_color = 'green'),col = j, row = i)
+                fig.add_trace(go.Scattergl(x=df['Date'][is_low], y=df[norm_feat][is_low],showlegend = False, mode='markers',name = 'high low', marker_color = 'red'),col = j, row = i)
             except:
                 pass
             
@@ -634,22 +605,13 @@ def rank_by_return(data, lag_days, top_n = 5):
             Returns:
                     result (list): resulting assets top n most important
     '''
-    data = data.sort_values(['Ticket','Date'], ascending=[False,False]).reset_index(drop = True)
-    data['first'] = data.sort_values(['Date'], ascending=[False]).groupby(['Ticket']).cumcount() + 1
-    data =  data[data['first'] <= lag_days]
-    
-    data = data.sort_values(['Ticket','Date'], ascending=[False,False]).reset_index(drop = True)
-    data['last'] = data.sort_values(['Date'], ascending=[True]).groupby(['Ticket']).cumcount() + 1
-    
-    data = data[(data['first'] == 1) | (data['last'] == 1)]
-    
-    data['last_Close'] = data.groupby('Ticket')['Close'].transform(lambda x: x.shift(-1))
-    data = data[(data['first'] == 1)]
-    data['return'] = (data['Close']/data['last_Close'] - 1)*100
-    data = data.sort_values('return', ascending = True)
-    data = data.iloc[:top_n,:]
-    
-    result = list(data.Ticket.values)
+    ## latest close against the oldest close of the last lag_days rows per ticket
+    data = data.sort_values(['Ticket','Date']).groupby('Ticket').tail(lag_days)
+    last_close = data.drop_duplicates('Ticket', keep = 'last').set_index('Ticket')['Close']
+    reference_close = data.drop_duplicates('Ticket', keep = 'first').set_index('Ticket')['Close']
+    returns = ((last_close/reference_close - 1)*100).where(data.groupby('Ticket').size() > 1)
+
+    result = list(returns.nsmallest(top_n).index)
     
     return result
 
@@ -770,6 +732,31 @@ def get_data(ticker_name:str, ticket_settings:dict, n_days:int = False, hmm_avai
 
 trends = {'adjusted' : 0.001, 'smooth' : 0.0001}
 
+def kalman_filter_1d(observations, transition_covariance, initial_state_mean = 0.0, initial_state_covariance = 1.0, observation_covariance = 1.0):
+    '''
+    filtered state means of a random walk kalman filter with scalar state and observation (unit transition and observation matrices)
+
+            Parameters:
+                    observations (np.array): observed values
+                    transition_covariance (float): transition covariance
+                    initial_state_mean (float): initial state mean
+                    initial_state_covariance (float): initial state covariance
+                    observation_covariance (float): observation covariance
+            Returns:
+                    state_means (np.array): filtered state means
+    '''
+    observations = np.asarray(observations, dtype = float).ravel()
+    state_means = np.empty_like(observations)
+    state_mean, state_covariance = float(initial_state_mean), float(initial_state_covariance)
+    for t, observation in enumerate(observations.tolist()):
+        if t > 0:
+            state_covariance = state_covariance + transition_covariance
+        gain = state_covariance / (state_covariance + observation_covariance)
+        state_mean = state_mean + gain * (observation - state_mean)
+        state_covariance = (1 - gain) * state_covariance
+        state_means[t] = state_mean
+    return state_means
+
 def apply_KF(self, trends):
     '''
     create kalman filter feature and attach it to the stock_eda_panel object
@@ -779,19 +766,25 @@ def apply_KF(self, trends):
             Returns:
                     none
     '''
+    close = self.df['Close'].to_numpy()
     for ttrend in trends:
         tcov = trends.get(ttrend)
-        kf = KalmanFilter(transition_matrices = [1],
-                             observation_matrices = [1],
-                             initial_state_mean = 0,
-                             initial_state_covariance = 1,
-                             observation_covariance=1,
-                             transition_covariance=tcov)
-        vector = kf.filter(self.df[['Close']])[0]
-        self.df[f'KalmanFilter_{ttrend}'] = vector.reshape((vector.shape[0]))
+        self.df[f'KalmanFilter_{ttrend}'] = kalman_filter_1d(close, transition_covariance = tcov)
         
 stock_eda_panel.apply_KF = apply_KF
 
+@lru_cache(maxsize = 128)
+def load_mlflow_model(model_uri):
+    '''
+    load a mlflow pyfunc model, cached by uri. uris include the run id so a new production run is loaded again
+
+            Parameters:
+                    model_uri (str): mlflow model uri e.g. runs:/<run_id>/<model_name>
+            Returns:
+                    model (obj): mlflow pyfunc model
+    '''
+    return mlflow.pyfunc.load_model(model_uri, suppress_warnings = True)
+
 def call_ml_objects(stock_code, client, call_models = False):
     '''
     call artifcats from mlflow
@@ -817,18 +810,12 @@ def call_ml_objects(stock_code, client, call_models = False):
 
      ## calling models
     
-    hmm_model = mlflow.pyfunc.load_model(
-            f"runs:/{run_id_prod_model}/{stock_code}-hmm-model",
-             suppress_warnings = True
-            )
+    hmm_model = load_mlflow_model(f"runs:/{run_id_prod_model}/{stock_code}-hmm-model")
     objects['called_hmm_models'] = hmm_model
     
     if call_models:
         
-        forecasting_model = mlflow.pyfunc.load_model(
-            f"runs:/{run_id_prod_model}/{stock_code}-forecasting-model",
-             suppress_warnings = True
-            )
+        forecasting_model = load_mlflow_model(f"runs:/{run_id_prod_model}/{stock_code}-forecasting-model")
         objects['called_forecasting_model'] = forecasting_model
         
     object_stock = get_data(
@@ -847,6 +834,55 @@ def call_ml_objects(stock_code, client, call_models = False):
     
     return objects
 
+def hmm_chains(states):
+    '''
+    chain id and position within the chain of consecutive equal hmm states, in a single vector pass
+
+            Parameters:
+                    states (np.array): hmm state sequence ordered by date
+            Returns:
+                    chain_id (np.array): chain id starting at 1
+                    chain_order (np.array): position within the chain starting at 1
+    '''
+    states = np.asarray(states)
+    breack = np.ones(len(states), dtype = bool)
+    breack[1:] = states[1:] != states[:-1]
+    chain_id = np.cumsum(breack)
+    chain_starts = np.flatnonzero(breack)
+    chain_order = np.arange(1, len(states) + 1) - chain_starts[chain_id - 1]
+    return chain_id, chain_order
+
+def parse_prediction_dates(values):
+    '''
+    parse a column of dates that may mix formats, using the ISO8601 fast path when every value fits it
+
+            Parameters:
+                    values (pd.Series): dates as strings or timestamps
+            Returns:
+                    dates (pd.Series): dates as datetime.date
+    '''
+    try:
+        dates = pd.to_datetime(values, format='ISO8601', utc=True, errors='coerce')
+        ## slow per element parsing only if the iso fast path failed on non null values
+        if (dates.isna() & values.notna()).any():
+            dates = pd.to_datetime(values, format='mixed', utc=True)
+    except ValueError:
+        ## pandas < 2.0 knows neither the ISO8601 nor the mixed format
+        dates = pd.to_datetime(values, utc=True)
+    return dates.dt.date
+
+def _compact(values, decimals = 4):
+    '''
+    round plotted values so that the figure json carries short decimals instead of full float64 precision
+
+            Parameters:
+                    values (array-like): values to plot
+                    decimals (int): number of decimals to keep
+            Returns:
+                    values (np.array): rounded values
+    '''
+    return np.round(np.asarray(values, dtype = float), decimals)
+
 class produce_plotly_plots:
     """
     class that helps to produce different dashboards
@@ -879,6 +915,8 @@ class produce_plotly_plots:
         display plots that analyse hmm states
     produce_forecasting_plot(predictions=pd.DataFrame):
         display forecasting plots
+    wait_uploads():
+        block until the background s3 uploads are done, called at the end of every plot method
     """
     def __init__(self,ticket_name, data_frame,settings, save_path = False, save_aws = False, show_plot= True, aws_credentials = False, return_figs = False):
         """
@@ -907,6 +945,90 @@ class produce_plotly_plots:
         self.show_plot = show_plot
         self.aws_credentials = aws_credentials
         self.return_figs = return_figs
+        self._upload_pool = None
+        self._upload_futures = list()
+
+    @cached_property
+    def _sorted_states(self):
+        """
+        sorted hmm states present in the data, computed once per object
+        """
+        return sorted(self.data_frame['hmm_feature'].unique().tolist())
+
+    @cached_property
+    def _color_map(self):
+        """
+        color of every hmm state, computed once per object
+        """
+        hmm_n_clust = self.settings['settings']['hmm']['n_clusters']
+        return { i:DEFAULT_PLOTLY_COLORS[i] for i in range(hmm_n_clust)}
+
+    @property
+    def _has_output(self):
+        """
+        true if the figure is displayed, saved or returned, otherwise building it is wasted work
+        """
+        return bool(self.show_plot or self.save_path or self.return_figs)
+
+    def _submit_upload(self, data, key, extra_args = None):
+        """
+        upload bytes to s3 in a background thread, so the upload overlaps with the rest of the plot method.
+        every upload owns its bytes, so later writes to the same local files do not affect it
+
+        Parameters
+        ----------
+        data (bytes): content to upload
+        key (str): s3 key
+        extra_args (dict): optional object metadata
+
+        Returns
+        -------
+        None
+        """
+        s3 = get_s3_client(self.aws_credentials)
+        if self._upload_pool is None:
+            self._upload_pool = ThreadPoolExecutor(max_workers = 4)
+        self._upload_futures.append(self._upload_pool.submit(upload_bytes_to_aws, data, bucket = 'VIRGO_BUCKET', key = key,
+                                                              aws_credentials = self.aws_credentials, extra_args = extra_args, s3 = s3))
+
+    def wait_uploads(self):
+        """
+        block until the pending s3 uploads are done, upload errors are raised here
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+        futures, self._upload_futures = self._upload_futures, list()
+        errors = [future.exception() for future in futures]
+        for error in errors:
+            if error is not None:
+                raise error
+
+    def _save_figure(self, fig, result_json_name):
+        """
+        write the figure as gzip compressed json and upload it to s3 with gzip content encoding
+
+        Parameters
+        ----------
+        fig (obj): plotly figure
+        result_json_name (str): json file name e.g. 'ts_hmm.json', '.gz' is appended
+
+        Returns
+        -------
+        None
+        """
+        result_json_name = result_json_name + '.gz'
+        if self.save_path:
+            data = gzip.compress(fig.to_json(engine = PLOTLY_JSON_ENGINE).encode('utf8'))
+            with open(self.save_path + result_json_name, 'wb') as outfile:
+                outfile.write(data)
+        if self.save_path and self.save_aws:
+            self._submit_upload(data, key = self.save_aws + result_json_name, extra_args = {'ContentEncoding':'gzip', 'ContentType':'application/json'})
 
     def plot_asset_signals(self, feature_list,spread_column, date_intervals = False, look_back = 800):
         """
@@ -922,6 +1044,8 @@ class produce_plotly_plots:
         -------
         fig (obj): plotly dashboard
         """
+        if not self._has_output:
+            return
         result_json_name = 'panel_signals.json'
         df = self.data_frame
         if look_back:
@@ -950,7 +1074,7 @@ class produce_plotly_plots:
 
         rows_subplot = feature_rows + 1
         height_plot = rows_subplot * 400
-        color_map = { i:DEFAULT_PLOTLY_COLORS[i] for i in range(hmm_n_clust)}
+        color_map = self._color_map
 
         ### expand hmm analysis
 
@@ -967,20 +1091,24 @@ class produce_plotly_plots:
             # signal
             for norm_feat in norm_list:
                 if norm_feat in df.columns:
-                    fig.add_trace(go.Scatter(x=df['Date'], y=df[norm_feat],showlegend= False, mode='lines', marker_color = 'grey'),col = 1, row = row_i)
+                    fig.add_trace(go.Scattergl(x=df['Date'], y=_compact(df[norm_feat]),showlegend= False, mode='lines', marker_color = 'grey'),col = 1, row = row_i)
                     break
             for norm_feat in norm_list:
                 if norm_feat in df.columns:
-                    fig.add_trace(go.Scatter(x=df['Date'], y=np.where(df[norm_feat] > 0, df[norm_feat], np.nan),showlegend= False, mode='markers', marker_color = 'green',opacity = 0.3),col = 1, row = row_i)
-                    fig.add_trace(go.Scatter(x=df['Date'], y=np.where(df[norm_feat] <= 0, df[norm_feat], np.nan),showlegend= False, mode='markers', marker_color = 'red',opacity = 0.3),col = 1, row = row_i)
+                    is_positive = df[norm_feat] > 0
+                    is_negative = df[norm_feat] <= 0
+                    fig.add_trace(go.Scattergl(x=df['Date'][is_positive], y=_compact(df[norm_feat][is_positive]),showlegend= False, mode='markers', marker_color = 'green',opacity = 0.3),col = 1, row = row_i)
+                    fig.add_trace(go.Scattergl(x=df['Date'][is_negative], y=_compact(df[norm_feat][is_negative]),showlegend= False, mode='markers', marker_color = 'red',opacity = 0.3),col = 1, row = row_i)
                     break
             for signal_up in signal_up_list:
                 if signal_up in df.columns:
-                    fig.add_trace(go.Scatter(x=df['Date'], y=np.where(df[signal_up] == 1, df[norm_feat], np.nan),showlegend= False, mode='markers', marker_color = 'green'),col = 1, row = row_i)
+                    is_up = df[signal_up] == 1
+                    fig.add_trace(go.Scattergl(x=df['Date'][is_up], y=_compact(df[norm_feat][is_up]),showlegend= False, mode='markers', marker_color = 'green'),col = 1, row = row_i)
 
             for signal_low in signal_low_list:
                 if signal_low in df.columns:
-                    fig.add_trace(go.Scatter(x=df['Date'], y=np.where(df[signal_low] == 1, df[norm_feat], np.nan),showlegend= False, mode='markers', marker_color = 'red'),col = 1, row = row_i)
+                    is_low = df[signal_low] == 1
+                    fig.add_trace(go.Scattergl(x=df['Date'][is_low], y=_compact(df[norm_feat][is_low]),showlegend= False, mode='markers', marker_color = 'red'),col = 1, row = row_i)
             fig.add_hline(y=0, line_width=2, line_dash="dash", line_color="grey",col = 1, row = row_i)
         fig.update_layout(height=height_plot, width=1600, title_text = f'asset plot and signals: {self.ticket_name}')
 
@@ -989,26 +1117,23 @@ class produce_plotly_plots:
         map_ = {i:f'state_{i}' for i in range(hmm_n_clust)}
         df['HMM_state'] =  df['hmm_feature'].map(map_)
 
-        fig.add_trace(go.Scatter(x=df['Date'], y=df['Close'], mode='lines',marker_color ='blue'),row=row_i, col=1)
+        fig.add_trace(go.Scattergl(x=df['Date'], y=_compact(df['Close']), mode='lines',marker_color ='blue'),row=row_i, col=1)
         for state in df['HMM_state'].unique():
             dfi = df[df['HMM_state'] == state]
             hmm_id = dfi['hmm_feature'].unique()[0]
-            fig.add_trace(go.Scatter(x=dfi['Date'], y=dfi['Close'], mode='markers',name = state, marker_color = color_map[hmm_id]),row=row_i, col=1)
+            fig.add_trace(go.Scattergl(x=dfi['Date'], y=_compact(dfi['Close']), mode='markers',name = state, marker_color = color_map[hmm_id]),row=row_i, col=1)
 
-        fig.add_trace(go.Scatter(x=df['Date'], y=df['KalmanFilter_adjusted'], mode='lines',name = 'KF_adjusted', marker_color = 'grey'),row=row_i, col=1)
-        fig.add_trace(go.Scatter(x=df['Date'], y=df['KalmanFilter_smooth'], mode='lines',name = 'KF_smooth', marker_color = 'darkviolet'),row=row_i, col=1)
+        fig.add_trace(go.Scattergl(x=df['Date'], y=_compact(df['KalmanFilter_adjusted']), mode='lines',name = 'KF_adjusted', marker_color = 'grey'),row=row_i, col=1)
+        fig.add_trace(go.Scattergl(x=df['Date'], y=_compact(df['KalmanFilter_smooth']), mode='lines',name = 'KF_smooth', marker_color = 'darkviolet'),row=row_i, col=1)
 
         if date_intervals:
             for interval in date_intervals:
                 fig.add_vrect(x0=interval[0], x1=interval[1], line_width=0, fillcolor="red", opacity=0.2)
 
-        if self.save_path:
-            fig.write_json(self.save_path+result_json_name)
+        self._save_figure(fig, result_json_name)
         if self.show_plot:
             fig.show()
-        if self.save_path and self.save_aws:
-            # upload_file_to_aws(bucket = 'VIRGO_BUCKET', key = f'market_plots/{self.ticket_name}/'+result_json_name ,input_path = self.save_path+result_json_name)
-            upload_file_to_aws(bucket = 'VIRGO_BUCKET', key = self.save_aws + result_json_name, input_path = self.save_path + result_json_name, aws_credentials = self.aws_credentials)
+        self.wait_uploads()
         if self.return_figs:
             return fig
         
@@ -1024,6 +1149,8 @@ class produce_plotly_plots:
         -------
         fig (obj): plotly dashboard
         """
+        if not self._has_output:
+            return
         result_json_name = 'ts_hmm.json'
         df = self.data_frame
         hmm_n_clust = self.settings['settings']['hmm']['n_clusters']
@@ -1032,8 +1159,7 @@ class produce_plotly_plots:
         rows_subplot = state_rows 
         height_plot = rows_subplot * 400
 
-        states = list(df.hmm_feature.unique())
-        states.sort()
+        states = self._sorted_states
         states_subtitles = [f'state {x}' for x in states]
         if len(states_subtitles)%2 == 1:
             states_subtitles = states_subtitles + [None]
@@ -1045,28 +1171,31 @@ class produce_plotly_plots:
             subplot_titles =  states_subtitles )
 
         ### only states scaled series
-        states = list(df.hmm_feature.unique())
-        color_map = { i:DEFAULT_PLOTLY_COLORS[i] for i in range(hmm_n_clust)}
-        states.sort()
+        color_map = self._color_map
+        ## rows sorted by state and chain once, lexsort keeps the date order within every chain
+        df_sorted = df.sort_values(['hmm_feature','chain_id'])
+        hmm_values = df_sorted['hmm_feature'].to_numpy()
+        chain_values = df_sorted['chain_id'].to_numpy()
+        chain_orders = df_sorted['hmm_chain_order'].to_numpy(dtype = float)
+        chain_returns = _compact(df_sorted['chain_return'])
         row_i = 1
         for state in states:
             colx = int(state)%2 + 1
-            dfi = df[df.hmm_feature == state]
-            chains = list(dfi.chain_id.unique())
-            for chain in chains:
-                dfj = dfi[dfi.chain_id == chain]
-                fig.add_trace(go.Scatter(x=dfj.hmm_chain_order, y=dfj.chain_return, mode='lines', marker_color = color_map[state],showlegend=False),row=row_i, col=colx)
+            start, end = np.searchsorted(hmm_values, state, side = 'left'), np.searchsorted(hmm_values, state, side = 'right')
+            # one trace per state, a nan gap closes every chain
+            _, chain_starts = np.unique(chain_values[start:end], return_index = True)
+            gaps = np.append(chain_starts[1:], end - start)
+            xs = np.insert(chain_orders[start:end], gaps, np.nan)
+            ys = np.insert(chain_returns[start:end], gaps, np.nan)
+            fig.add_trace(go.Scattergl(x=xs, y=ys, mode='lines', marker_color = color_map[state],showlegend=False),row=row_i, col=colx)
             if colx == 2:
                 row_i +=1
         fig.update_layout(height=height_plot, width=1600, title_text = f'time series by state: {self.ticket_name}') 
         
-        if self.save_path:
-            fig.write_json(self.save_path+result_json_name)
+        self._save_figure(fig, result_json_name)
         if self.show_plot:
             fig.show()
-        if self.save_path and self.save_aws:
-            # upload_file_to_aws(bucket = 'VIRGO_BUCKET', key = f'market_plots/{self.ticket_name}/'+result_json_name ,input_path = self.save_path+result_json_name)
-            upload_file_to_aws(bucket = 'VIRGO_BUCKET', key = self.save_aws + result_json_name, input_path = self.save_path + result_json_name, aws_credentials = self.aws_credentials)
+        self.wait_uploads()
         if self.return_figs:
             return fig
         
@@ -1085,15 +1214,16 @@ class produce_plotly_plots:
         fig (obj): plotly dashboard
         messages (dict): hmm model metrics
         """
+        if not self._has_output:
+            return
         result_json_name = 'hmm_analysis.json'
         df = self.data_frame
         hmm_n_clust = self.settings['settings']['hmm']['n_clusters']
 
         rows_subplot = 2
         height_plot = rows_subplot * 400
-        color_map = { i:DEFAULT_PLOTLY_COLORS[i] for i in range(hmm_n_clust)}
-        states = list(df.hmm_feature.unique())
-        states.sort()    
+        color_map = self._color_map
+        states = self._sorted_states
         ### expand hmm analysis
         hmm_titles = ['state return (base first observation)','Transition matrix heatmap','length chains dist']
 
@@ -1108,69 +1238,64 @@ class produce_plotly_plots:
         ### transition probabilities
         row_i = 1
         # t_matrix = (hmm_model._model_impl['hmm'].transmat_)*100
-        fig.add_trace(go.Heatmap(z = t_matrix, text = np.round(t_matrix,2),texttemplate="%{text}",coloraxis='coloraxis'),row=row_i, col=2)
+        t_matrix = np.round(np.asarray(t_matrix, dtype = float), 2)
+        fig.add_trace(go.Heatmap(z = t_matrix, text = t_matrix,texttemplate="%{text}",coloraxis='coloraxis'),row=row_i, col=2)
         fig.update_xaxes(title_text='State To', row=row_i, col=2)
         fig.update_yaxes(title_text='State From', row=row_i, col=2)
 
         ## returns of state
         df_ = df[['Date','hmm_feature','Close',"chain_return"]].sort_values('Date')
-        df_['Daily_Returns'] = df['Close'].pct_change(7)
+        close = df['Close'].to_numpy(dtype = float)
+        returns_7 = np.full(len(close), np.nan)
+        returns_7[7:] = close[7:] / close[:-7] - 1
+        df_['Daily_Returns'] = pd.Series(returns_7, index = df.index)
 
-        df_agg_returns = df_.groupby('hmm_feature', as_index = False).agg(median =('Daily_Returns','median')).copy()
-        current_state = df_.iloc[-1,:].hmm_feature
+        df_agg_returns = df_.groupby('hmm_feature', as_index = False, observed = True, sort = False).agg(median =('Daily_Returns','median')).copy()
+        current_state = df_['hmm_feature'].iat[-1]
         medain_state_return = df_agg_returns[ df_agg_returns.hmm_feature == current_state]['median'].values[0]
         type_state = 'low state' if medain_state_return < 0 else 'high state'
 
+        returns_by_state = df_.groupby('hmm_feature', observed = True, sort = False)['chain_return'].apply(np.asarray).to_dict()
         for state in states:
-            dfi = df_[df_.hmm_feature == state]
-            fig.add_trace(go.Box(y = dfi.chain_return, name=str(state),showlegend=False, marker_color = color_map[state] ),row=1, col=1)
+            fig.add_trace(go.Box(y = _compact(returns_by_state[state]), name=str(state),showlegend=False, marker_color = color_map[state] ),row=1, col=1)
         fig.add_hline(y=0, line_width=2, line_dash="dash", line_color="grey",row=1, col=1)
         
         ## lengths chains by state dist
         if 'hmm_chain_order' in df.columns:
-            df_agg = df.groupby(['hmm_feature','chain_id'],as_index = False).agg(length_by_chain = ('hmm_chain_order','max'))
+            df_agg = df.groupby(['hmm_feature','chain_id'],as_index = False, observed = True, sort = False).agg(length_by_chain = ('hmm_chain_order','max'))
 
         else:
-            df['lag_hmm_feature'] = df['hmm_feature'].shift(1)
-            df['breack'] = np.where(df['lag_hmm_feature'] != df['hmm_feature'],1,0)
-            df["chain_id"] = df.groupby("breack")["Date"].rank(method="first", ascending=True)
-            df["chain_id"] = np.where(df['breack'] == 1,df["chain_id"],np.nan)
-            df["chain_id"] = df["chain_id"].fillna(method='ffill')
-            df["hmm_chain_order"] = df.groupby('chain_id')["Date"].rank(method="first", ascending=True)
+            chain_id, chain_order = hmm_chains(df['hmm_feature'].to_numpy())
+            ## float like the rank based columns, market_message reports the step as e.g. '8.0'
+            df["chain_id"] = chain_id.astype(float)
+            df["hmm_chain_order"] = chain_order.astype(float)
 
-            df_agg = df.groupby(['hmm_feature','chain_id'],as_index = False).agg(length_by_chain = ('hmm_chain_order','max'))
+            df_agg = df.groupby(['hmm_feature','chain_id'],as_index = False, observed = True, sort = False).agg(length_by_chain = ('hmm_chain_order','max'))
 
+        lengths_by_state = df_agg.groupby('hmm_feature', observed = True, sort = False)['length_by_chain'].apply(np.asarray).to_dict()
         for state in states:
-            dfi = df_agg[df_agg.hmm_feature == state]
-            fig.add_trace(go.Box(y = dfi.length_by_chain, name=str(state),showlegend=False, marker_color = color_map[state] ),row=2, col=1)
+            fig.add_trace(go.Box(y = lengths_by_state[state], name=str(state),showlegend=False, marker_color = color_map[state] ),row=2, col=1)
         
         ## feature importance of regressor
         if model and settings['model_type'] == 'Forecaster':
             
             n_regresors = self.settings['settings']['target_lasts']['steps']
-            importances = list()
-            for regressor_x in range(n_regresors): 
-                importances.append(model._model_impl['model'].estimators_[regressor_x].feature_importances_)
-            importances = np.vstack( importances )
+            importances = np.stack([estimator.feature_importances_ for estimator in model._model_impl['model'].estimators_[:n_regresors]])
 
             default_features_in_model = [f'label_{i}' for i in range(1,importances.shape[1]+1)]
             features_in_model = settings.get('selected_feature_list_prod', default_features_in_model)
 
-            importances_df = pd.DataFrame(importances, columns = features_in_model)
-            importances_df = importances_df.melt(value_vars=features_in_model,var_name='feature', value_name='importance')
-            importances_df['median'] = importances_df['feature'].map(importances_df.groupby('feature')['importance'].median())
-            importances_df = importances_df.sort_values('median', ascending = False)
-
-            for feature in importances_df.feature.unique():
-                dfi = importances_df[importances_df.feature == feature]
-                fig.add_trace(go.Box(x = dfi.importance, name=str(feature),showlegend=False ),row=2, col=2)
+            ## features sorted by descending median importance
+            feature_order = np.argsort(-np.median(importances, axis = 0), kind = 'stable')
+            for k in feature_order:
+                fig.add_trace(go.Box(x = importances[:,k], name=str(features_in_model[k]),showlegend=False ),row=2, col=2)
             fig.update_yaxes(visible=False, title="feature",row=2, col=2)
 
         fig.update_layout(height=height_plot, width=1600, title_text = f'State model analysis: {self.ticket_name}', coloraxis=dict(colorbar_len=0.50))
 
         date_execution = datetime.datetime.today().strftime('%Y-%m-%d')
-        current_step = df.iloc[-1,:].hmm_chain_order
-        current_state = df.iloc[-1,:].hmm_feature
+        current_step = df['hmm_chain_order'].iat[-1]
+        current_state = df['hmm_feature'].iat[-1]
         message1 = str(current_state)
         message2 = str(current_step)
         message3 = str(date_execution)
@@ -1197,17 +1322,16 @@ class produce_plotly_plots:
             print(message2)
             print(message3)
             
+        self._save_figure(fig, result_json_name)
         if self.save_path:
-            fig.write_json(self.save_path+result_json_name)
-            with open(self.save_path+"market_message.json", "w") as outfile: 
-                json.dump(messages, outfile)
+            message_data = json.dumps(messages).encode('utf8')
+            with open(self.save_path+"market_message.json", "wb") as outfile: 
+                outfile.write(message_data)
                 
         if self.save_path and self.save_aws:
-            # upload_file_to_aws(bucket = 'VIRGO_BUCKET', key = f'market_plots/{self.ticket_name}/'+result_json_name ,input_path = self.save_path+result_json_name)
             # upload_file_to_aws(bucket = 'VIRGO_BUCKET', key = f'market_plots/{self.ticket_name}/'+'market_message.json',input_path = self.save_path+"market_message.json")
-            
-            upload_file_to_aws(bucket = 'VIRGO_BUCKET', key = self.save_aws + result_json_name, input_path = self.save_path + result_json_name, aws_credentials = self.aws_credentials)
-            upload_file_to_aws(bucket = 'VIRGO_BUCKET', key = self.save_aws + 'market_message.json', input_path = self.save_path + 'market_message.json', aws_credentials = self.aws_credentials)
+            self._submit_upload(message_data, key = self.save_aws + 'market_message.json')
+        self.wait_uploads()
         
         if self.return_figs:
             return fig, messages
@@ -1232,6 +1356,8 @@ class produce_plotly_plots:
         def ql(x):
             return x.quantile(0.95)
         
+        if not self._has_output:
+            return
         result_json_name = 'forecast_plot.json'
         hmm_n_clust = self.settings['settings']['hmm']['n_clusters']
         model_type = self.settings.get('model_type',False)
@@ -1250,14 +1376,8 @@ class produce_plotly_plots:
         predictions = predictions[predictions.StockCode == self.ticket_name]
         if len(predictions) > 1: 
 
-            try:
-                predictions['ExecutionDate'] = pd.to_datetime(predictions['ExecutionDate'], format='mixed',utc=True).dt.date
-            except:
-                predictions['ExecutionDate'] = pd.to_datetime(predictions['ExecutionDate'],utc=True).dt.date
-            try:
-                predictions['Date'] = pd.to_datetime(predictions['Date'], format='mixed',utc=True).dt.date
-            except:
-                predictions['Date'] = pd.to_datetime(predictions['Date'],utc=True).dt.date
+            for date_column in ['ExecutionDate', 'Date']:
+                predictions[date_column] = parse_prediction_dates(predictions[date_column])
 
             last_exe_prediction_date = predictions.ExecutionDate.unique()
             last_date = max(last_exe_prediction_date)
@@ -1265,49 +1385,47 @@ class produce_plotly_plots:
             history = self.data_frame.sort_values('Date').iloc[-window:,:]
             cut_date = history.loc[history.iloc[-1:,:].index[0]:,'Date'].item()
             prediction = predictions[predictions.Type == 'Prediction']
+            prediction_by_date = dict(list(prediction.groupby('ExecutionDate', sort = False)))
+            previous_predictions = [prediction_by_date[x] for x in last_exe_prediction_date if x != last_date and x in prediction_by_date]
+            last_prediction = prediction_by_date.get(last_date, prediction.iloc[:0])
 
             ## log returns
             def add_intervals(data,feature,i,w=5):
                 df_qs = data.sort_values('Date')[['Date',feature]].rolling(3,min_periods = 1,on='Date').apply(qs).groupby('Date',as_index=False)[feature].max()
                 df_qm = data.sort_values('Date')[['Date',feature]].rolling(3,min_periods = 1,on='Date').apply(qm).groupby('Date',as_index=False)[feature].max()
                 df_ql = data.sort_values('Date')[['Date',feature]].rolling(3,min_periods = 1,on='Date').apply(ql).groupby('Date',as_index=False)[feature].max()
-                fig.add_trace(go.Scatter(x=df_qs.Date, y=df_qs[feature], mode='lines',marker_color ='#D0D0D0',showlegend=False,opacity=0.05),row=1, col=i)
-                fig.add_trace(go.Scatter(x=df_qm.Date, y=df_qm[feature], mode='lines',marker_color ='#D0D0D0',showlegend=False,opacity=0.05, fill='tonexty'),row=1, col=i)
-                fig.add_trace(go.Scatter(x=df_ql.Date, y=df_ql[feature], mode='lines',marker_color ='#D0D0D0',showlegend=False,opacity=0.05, fill='tonexty'),row=1, col=i)
+                fig.add_trace(go.Scattergl(x=df_qs.Date, y=_compact(df_qs[feature]), mode='lines',marker_color ='#D0D0D0',showlegend=False,opacity=0.05),row=1, col=i)
+                fig.add_trace(go.Scattergl(x=df_qm.Date, y=_compact(df_qm[feature]), mode='lines',marker_color ='#D0D0D0',showlegend=False,opacity=0.05, fill='tonexty'),row=1, col=i)
+                fig.add_trace(go.Scattergl(x=df_ql.Date, y=_compact(df_ql[feature]), mode='lines',marker_color ='#D0D0D0',showlegend=False,opacity=0.05, fill='tonexty'),row=1, col=i)
 
-            fig.add_trace(go.Scatter(x=history.Date, y=history.log_return, mode='lines',marker_color ='blue',showlegend=False),row=1, col=1)
+            fig.add_trace(go.Scattergl(x=history.Date, y=_compact(history.log_return), mode='lines',marker_color ='blue',showlegend=False),row=1, col=1)
 
-            for i,datex in enumerate([x for x in last_exe_prediction_date if x != last_date]):
-                df = prediction[prediction.ExecutionDate == datex]
-                fig.add_trace(go.Scatter(x=df.Date, y=df.log_return, mode='markers',marker_color ='grey',showlegend=False),row=1, col=1)
+            for df in previous_predictions:
+                fig.add_trace(go.Scattergl(x=df.Date, y=_compact(df.log_return), mode='markers',marker_color ='grey',showlegend=False),row=1, col=1)
 
-            df = prediction[prediction.ExecutionDate == last_date]
-            fig.add_trace(go.Scatter(x=df.Date, y=df.log_return, mode='lines',marker_color ='#ff7f0e',showlegend=False),row=1, col=1)
-            fig.add_trace(go.Scatter(x=df.Date, y=df.log_return, mode='markers',marker_color ='#ff7f0e',showlegend=False),row=1, col=1)
+            df = last_prediction
+            fig.add_trace(go.Scattergl(x=df.Date, y=_compact(df.log_return), mode='lines',marker_color ='#ff7f0e',showlegend=False),row=1, col=1)
+            fig.add_trace(go.Scattergl(x=df.Date, y=_compact(df.log_return), mode='markers',marker_color ='#ff7f0e',showlegend=False),row=1, col=1)
             fig.add_hline(y=0, line_width=2, line_dash="dash", line_color="grey",col = 1, row = 1)
             add_intervals(data=prediction,feature='log_return',i=1)
 
             ## closing prices
-            fig.add_trace(go.Scatter(x=history.Date, y=history.Close, mode='lines',marker_color ='blue',showlegend=False),row=1, col=2)
-            for i,datex in enumerate([x for x in last_exe_prediction_date if x != last_date]):
-                df = prediction[prediction.ExecutionDate == datex]
-                fig.add_trace(go.Scatter(x=df.Date, y=df.Close, mode='markers',marker_color ='grey',showlegend=False),row=1, col=2)
-
-            df = prediction[prediction.ExecutionDate == last_date]  
-            fig.add_trace(go.Scatter(x=df.Date, y=df.Close, mode='lines',marker_color ='#ff7f0e',showlegend=False),row=1, col=2)
-            fig.add_trace(go.Scatter(x=df.Date, y=df.Close, mode='markers',marker_color ='#ff7f0e',showlegend=False),row=1, col=2)
+            fig.add_trace(go.Scattergl(x=history.Date, y=_compact(history.Close), mode='lines',marker_color ='blue',showlegend=False),row=1, col=2)
+            for df in previous_predictions:
+                fig.add_trace(go.Scattergl(x=df.Date, y=_compact(df.Close), mode='markers',marker_color ='grey',showlegend=False),row=1, col=2)
+
+            df = last_prediction  
+            fig.add_trace(go.Scattergl(x=df.Date, y=_compact(df.Close), mode='lines',marker_color ='#ff7f0e',showlegend=False),row=1, col=2)
+            fig.add_trace(go.Scattergl(x=df.Date, y=_compact(df.Close), mode='markers',marker_color ='#ff7f0e',showlegend=False),row=1, col=2)
             fig.update_layout(height=height_plot, width=1600, title_text = f'forecasts: {self.ticket_name}')
             add_intervals(data=prediction,feature='Close',i=2)
         else:
             print('no forecasting history')
             
-        if self.save_path:
-            fig.write_json(self.save_path+result_json_name)
+        self._save_figure(fig, result_json_name)
         if self.show_plot:
             fig.show()
-        if self.save_path and self.save_aws:
-            # upload_file_to_aws(bucket = 'VIRGO_BUCKET', key = f'market_plots/{self.ticket_name}/'+result_json_name ,input_path = self.save_path+result_json_name)
-            upload_file_to_aws(bucket = 'VIRGO_BUCKET', key = self.save_aws + result_json_name, input_path = self.save_path + result_json_name, aws_credentials = self.aws_credentials)
+        self.wait_uploads()
         if self.return_figs:
             return fig
                 
@@ -1324,13 +1442,20 @@ def plot_hmm_analysis_logger(data_frame,test_data_size, save_path = False, show_
             Returns:
                     None
     '''
+    def state_box_stats(data):
+        ## box statistics per state computed directly with numpy, sorted by state
+        stats = list()
+        for state, dfi in data.dropna(subset = ['chain_return']).groupby('hmm_feature', sort = True, observed = True):
+            stats.extend(boxplot_stats(dfi['chain_return'].to_numpy(), labels = [state]))
+        return stats
+
     df = data_frame
     df_ = df[['Date','hmm_feature','Close',"chain_return"]].sort_values('Date')
     fig, axs = plt.subplots(1,2,figsize=(10,4))
-    df__ = df_.iloc[:-test_data_size,]
-    sns.boxplot(data=df__, x="hmm_feature", y="chain_return",ax = axs[0]).set_title('train dist')
-    df__ = df_.iloc[-test_data_size:,]
-    sns.boxplot(data=df__ , x="hmm_feature", y="chain_return",ax = axs[1]).set_title('test dist')
+    axs[0].bxp(state_box_stats(df_.iloc[:-test_data_size,]))
+    axs[0].set_title('train dist')
+    axs[1].bxp(state_box_stats(df_.iloc[-test_data_size:,]))
+    axs[1].set_title('test dist')
     if save_path:
         plt.savefig(save_path) 
     if not show_plot:
@@ -1361,13 +1486,13 @@ def plot_hmm_tsanalysis_logger(data_frame, test_data_size,save_path = False, sho
     fig, ax1 = plt.subplots(figsize=(10,4))
     ax1.plot(df_['Date'],df_["Close"])
     
-    for state in states:
-        df__ = df_[df_.hmm_feature == state]
-        ax1.scatter(df__['Date'],df__["Close"], label = state)
+    ## one scatter collection colored by state, same color cycle as the closing price line
+    color_map = {state:f'C{i+1}' for i, state in enumerate(states)}
+    ax1.scatter(df_['Date'],df_["Close"], c = df_['hmm_feature'].map(color_map).to_numpy())
     formatter = DateFormatter('%Y-%m-%d')
     if test_data_size:
         plt.axvline(x=date_limit, color = 'r')
-    fig.legend()
+    fig.legend(handles = [Line2D([], [], marker = 'o', linestyle = '', color = color, label = state) for state, color in color_map.items()])
     fig.autofmt_xdate()
     if save_path:
         plt.savefig(save_path) 
@@ -1,4 +1,5 @@
 from sklearn.base import BaseEstimator, TransformerMixin
+from joblib import Parallel, delayed
 import pandas as pd
 import numpy as np
 
@@ -90,11 +91,29 @@ class FeatureSelector(BaseEstimator, TransformerMixin):
         self.columns = columns
 
     def fit(self, X, y=None):
+        if X.columns.is_unique:
+            self.fit_columns_ = X.columns
+            self.columns_idx_ = X.columns.get_indexer(self.columns)
+        else:
+            self.fit_columns_ = None
         return self
 
     def transform(self, X, y=None):
+        ## positional selection when the input has the same layout seen in fit
+        fit_columns = getattr(self, 'fit_columns_', None)
+        if fit_columns is not None and (self.columns_idx_ >= 0).all() and self._same_layout(X.columns, fit_columns):
+            return X.iloc[:, self.columns_idx_]
         return X[self.columns]
 
+    @staticmethod
+    def _same_layout(columns, fit_columns):
+        ## cheap identity and length checks before the elementwise comparison
+        if columns is fit_columns:
+            return True
+        if len(columns) != len(fit_columns):
+            return False
+        return columns.equals(fit_columns)
+
 class FeaturesEntropy(BaseEstimator, TransformerMixin):
     """
     Class that creates a feature that calculate entropy for a given feature classes, but it might get some leackeage in the training set.
@@ -148,15 +167,15 @@ class FeaturesEntropy(BaseEstimator, TransformerMixin):
         
         df_aggr = (
             df
+            .assign(
+                trues_flag = (df[self.target] == 1).astype(int),
+                falses_flag = (df[self.target] == 0).astype(int),
+            )
             .groupby(column_list, as_index = False)
-            .apply(
-                lambda x: pd.Series(
-                    dict(
-                        counts = x[self.target].count(),
-                        trues=(x[self.target] == 1).sum(),
-                        falses=(x[self.target] == 0).sum(),
-                    )
-                )
+            .agg(
+                counts = (self.target, 'count'),
+                trues = ('trues_flag', 'sum'),
+                falses = ('falses_flag', 'sum'),
             )
             .assign(
                 trues_rate=lambda x: x['trues'] / x['counts']
@@ -192,12 +211,61 @@ class FeaturesEntropy(BaseEstimator, TransformerMixin):
         del df, df_aggr, X_
         return self
 
+    def get_entropy_feature(self, X):
+        entropy_feature = X[self.column_list].join(self.entropy_map.set_index(self.column_list), on=self.column_list, how = 'left')[self.feature_name]
+        return entropy_feature.fillna(self.default_null)
+
     def transform(self, X, y=None):
 
         X = X.join(self.entropy_map.set_index(self.column_list), on=self.column_list, how = 'left')
         X[self.feature_name] = X[self.feature_name].fillna(self.default_null)
         return X
 
+class ParallelFeaturesEntropy(BaseEstimator, TransformerMixin):
+    """
+    Class that creates several entropy features (see FeaturesEntropy) fitting and mapping each set concurrently.
+    this class is compatible with scikitlearn pipeline
+
+    Attributes
+    ----------
+    entropy_set_list : list
+        list of dictionaries that contains features (set, separated by //) and target to compute entropy
+    n_jobs: int
+        number of threads, -1 uses all the processors
+    entropy_transformers: list
+        list of fitted FeaturesEntropy objects
+
+    Methods
+    -------
+    fit(additional="", X=DataFrame, y=None):
+        fit transformation.
+    transform(X=DataFrame, y=None):
+        apply feature transformation
+    """
+
+    def __init__(self, entropy_set_list, n_jobs = -1):
+        self.entropy_set_list = entropy_set_list
+        self.n_jobs = n_jobs
+
+    def fit(self, X, y=None):
+        entropy_transformers = [
+            FeaturesEntropy(features = setx_['set'].split('//'), target = setx_['target'])
+            for setx_ in self.entropy_set_list
+        ]
+        self.entropy_transformers = Parallel(n_jobs = self.n_jobs, prefer = 'threads')(
+            delayed(transformer.fit)(X, y) for transformer in entropy_transformers
+        )
+        return self
+
+    def transform(self, X, y=None):
+        entropy_features = Parallel(n_jobs = self.n_jobs, prefer = 'threads')(
+            delayed(transformer.get_entropy_feature)(X) for transformer in self.entropy_transformers
+        )
+        X = X.copy()
+        for transformer, entropy_feature in zip(self.entropy_transformers, entropy_features):
+            X[transformer.feature_name] = entropy_feature
+        return X
+
 class signal_combiner(BaseEstimator, TransformerMixin):
 
     """